@@ -1,7 +1,103 @@
+import io
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
-from utils.data_processor import process_force_data, generate_pdf_report
+import numpy as np
+from utils.data_processor import process_force_data, generate_pdf_report, build_figure
+
+# 超過此大小的文件不整份載入，只讀取所選的兩個欄位
+LARGE_FILE_SIZE = 50 * 1024 * 1024
+PREVIEW_ROWS = 100
+
+# 所選欄位中無法轉為數值的比例超過此值時，視為非數值欄位
+MAX_NON_NUMERIC_RATIO = 0.5
+
+@st.cache_data
+def load_csv(file_bytes):
+    """讀取CSV文件（以文件內容作為快取鍵，使用多執行緒的pyarrow解析器）
+    
+    大文件只讀取前PREVIEW_ROWS行，供數據預覽與欄位選擇使用。
+    pyarrow無法處理的文件改用預設解析器，欄位命名與預設解析器一致。
+    """
+    if len(file_bytes) > LARGE_FILE_SIZE:
+        return pd.read_csv(io.BytesIO(file_bytes), nrows=PREVIEW_ROWS)
+    
+    try:
+        df = pd.read_csv(io.BytesIO(file_bytes), engine='pyarrow')
+    except ValueError:
+        # pyarrow無法解析（例如重複的欄位名稱、最後一行不完整）時改用預設解析器
+        return pd.read_csv(io.BytesIO(file_bytes))
+    
+    # 部分版本的pyarrow解析器會保留重複或空白的欄位名稱，改用預設解析器統一命名
+    if df.columns.duplicated().any() or '' in df.columns:
+        return pd.read_csv(io.BytesIO(file_bytes))
+    return df
+
+def load_force_columns(file_bytes, time_column, force_column):
+    """只讀取大文件中的時間與力量欄位，其餘欄位不載入記憶體
+    
+    與load_csv的預覽使用相同的預設解析器，介面上選擇的欄位名稱（如force.1、Unnamed: 2）
+    在這裡一定存在。
+    """
+    return pd.read_csv(
+        io.BytesIO(file_bytes),
+        usecols=[time_column, force_column]
+    )
+
+@st.cache_data
+def analyze_force_data(file_bytes, time_column, force_column):
+    """處理數據並找出關鍵點（以文件內容與所選欄位作為快取鍵）"""
+    if len(file_bytes) > LARGE_FILE_SIZE:
+        df = load_force_columns(file_bytes, time_column, force_column)
+    else:
+        df = load_csv(file_bytes)
+    
+    # 重命名選擇的欄位
+    df = df.rename(columns={
+        time_column: 'time',
+        force_column: 'force'
+    })
+    
+    # 非數值的內容轉為NaN；力量數據精度遠低於float64，降為float32可減少一半的掃描頻寬
+    # 時間保持float64，避免時間戳等大數值失去精度
+    if 'time' in df.columns:
+        df['time'] = pd.to_numeric(df['time'], errors='coerce').astype(np.float64)
+    if 'force' in df.columns:
+        df['force'] = pd.to_numeric(df['force'], errors='coerce').astype(np.float32)
+    
+    return process_force_data(df)
+
+@st.cache_data
+def build_pdf_report(file_bytes, time_column, force_column, _fig):
+    """生成PDF報告並返回其內容（圖表由相同輸入產生，不參與快取鍵）"""
+    df, points = analyze_force_data(file_bytes, time_column, force_column)
+    return generate_pdf_report(df, points, _fig)
+
+def is_numeric_column(series):
+    """檢查欄位是否為數值數據（無法轉為數值的比例不超過MAX_NON_NUMERIC_RATIO）
+    
+    大文件的load_csv只有前PREVIEW_ROWS行，因此只以這些行判斷；
+    之後的非數值內容會在analyze_force_data中轉為NaN。
+    """
+    if not pd.api.types.is_numeric_dtype(series):
+        series = pd.to_numeric(series, errors='coerce')
+    return series.isna().mean() <= MAX_NON_NUMERIC_RATIO
+
+def find_default_column(lowered_columns, keywords):
+    """依關鍵字優先順序找出預設欄位的索引
+    
+    每個關鍵字先以欄位名稱完全比對，再找第一個包含該關鍵字的欄位，都找不到則返回0。
+    """
+    column_index = {}
+    for idx, col in enumerate(lowered_columns):
+        column_index.setdefault(col, idx)
+    
+    for keyword in keywords:
+        if keyword in column_index:
+            return column_index[keyword]
+        for idx, col in enumerate(lowered_columns):
+            if keyword in col:
+                return idx
+    return 0
 
 def main():
     st.title("測力板數據分析系統")
@@ -11,7 +107,12 @@ def main():
     
     if uploaded_file is not None:
         # 讀取數據
-        df = pd.read_csv(uploaded_file)
+        file_bytes = uploaded_file.getvalue()
+        try:
+            df = load_csv(file_bytes)
+        except ValueError as e:
+            st.error(f"無法讀取CSV文件：{e}")
+            return
         
         # 顯示原始數據預覽
         st.subheader("數據預覽")
@@ -19,19 +120,13 @@ def main():
         
         # 選擇欄位
         columns = df.columns.tolist()
+        lowered_columns = [col.lower() for col in columns]
         col1, col2 = st.columns(2)
         
         with col1:
             # 找出可能的時間欄位（包含 'time' 的欄位名）
-            default_time_idx = 0
-            for keyword in ['时间', '時間', 'time']:
-                for idx, col in enumerate(columns):
-                    if keyword in col.lower():
-                        default_time_idx = idx
-                        break
-                if default_time_idx != 0:
-                    break
-                    
+            default_time_idx = find_default_column(lowered_columns, ['时间', '時間', 'time'])
+            
             time_column = st.selectbox(
                 "請選擇時間欄位",
                 options=columns,
@@ -40,73 +135,31 @@ def main():
         
         with col2:
             # 找出可能的力量欄位（包含 'force' 的欄位名）
-            default_force_idx = 0
-            for keyword in ['sumforce', 'force']:
-                for idx, col in enumerate(columns):
-                    if keyword in col.lower():
-                        default_force_idx = idx
-                        break
-                if default_force_idx != 0:
-                    break
-                    
+            default_force_idx = find_default_column(lowered_columns, ['sumforce', 'force'])
+            
             force_column = st.selectbox(
                 "請選擇力量欄位",
                 options=columns,
                 index=default_force_idx
             )
         
-        # 重命名選擇的欄位
-        df = df.rename(columns={
-            time_column: 'time',
-            force_column: 'force'
-        })
+        # 所選欄位必須是數值數據，否則不進行後續處理
+        for column, label in [(time_column, '時間'), (force_column, '力量')]:
+            if not is_numeric_column(df[column]):
+                st.error(f"所選的{label}欄位「{column}」不是數值數據，請重新選擇")
+                return
         
         # 處理數據
-        df, points = process_force_data(df)
+        df, points = analyze_force_data(file_bytes, time_column, force_column)
         
-        # 創建力量-時間圖
-        fig = go.Figure()
-        
-        # 添加主要曲線
-        fig.add_trace(go.Scatter(
-            x=df['time'],
-            y=df['force'],
-            mode='lines',
-            name='力量曲線'
-        ))
-        
-        # 設置不同點的文字位置和對齊方式
-        text_positions = {
-            'A': 'top center',      # A點文字在上方靠左
-            'B': 'middle right',  # B點文字在右側中間
-            'C': 'bottom right'   # C點文字在右下方
-        }
-        
-        # 添加關鍵點
-        for point_name, point_data in points.items():
-            # 只處理 A、B、C 點
-            if point_name in ['A', 'B', 'C']:
-                text_content = f'{point_name}點<br>時間: {point_data["time"]:.2f}s<br>力量: {point_data["force"]:.2f}N'
-                fig.add_trace(go.Scatter(
-                    x=[point_data['time']],
-                    y=[point_data['force']],
-                    mode='markers+text',
-                    name=f'點位 {point_name}',
-                    text=[text_content],
-                    textposition=text_positions[point_name],
-                    marker=dict(size=10),
-                    textfont=dict(size=12),  # 調整文字大小
-                ))
-        
-        # 設置圖表樣式
-        fig.update_layout(
-            title='力量-時間關係圖',
-            xaxis_title='時間 (秒)',
-            yaxis_title='力量 (N)',
-            hovermode='x unified',
-            # 增加圖表邊距以確保文字不會被切掉
-            margin=dict(l=50, r=100, t=50, b=50)  # 增加右側邊距
-        )
+        # 創建力量-時間圖（PDF報告沿用同一個圖表）
+        # 數據與欄位未改變時沿用session_state中的圖表，避免每次重新執行都重建
+        # 以上傳文件的file_id作為鍵，不需每次重新雜湊整個文件內容
+        fig_key = (uploaded_file.file_id, time_column, force_column)
+        if st.session_state.get('fig_key') != fig_key:
+            st.session_state.fig = build_figure(df, points)
+            st.session_state.fig_key = fig_key
+        fig = st.session_state.fig
         
         # 顯示圖表
         st.plotly_chart(fig, use_container_width=True)
@@ -128,9 +181,7 @@ def main():
             st.metric("恢復時間", f"{points['stats']['recovery_time']:.2f} s")
         
         # 生成並直接下載PDF報告
-        pdf_file = generate_pdf_report(df, points, fig)
-        with open(pdf_file, "rb") as f:
-            pdf_bytes = f.read()
+        pdf_bytes = build_pdf_report(file_bytes, time_column, force_column, fig)
         
         st.download_button(
             label="下載PDF報告",
@@ -0,0 +1 @@
+# 放在專案根目錄，讓pytest將根目錄加入sys.path，測試可直接匯入app與utils
@@ -0,0 +1,40 @@
+import numpy as np
+
+import app
+
+
+def test_load_csv_renames_duplicate_header():
+    df = app.load_csv(b'time,force,force\n0.0,1.0,2.0\n0.1,1.5,2.5\n')
+    assert df.columns.tolist() == ['time', 'force', 'force.1']
+    assert df['force.1'].tolist() == [2.0, 2.5]
+
+
+def test_load_csv_fills_truncated_last_line():
+    df = app.load_csv(b'time,force\n0.0,1.0\n0.1,1.5\n0.2\n')
+    assert df['time'].tolist() == [0.0, 0.1, 0.2]
+    assert np.isnan(df['force'].iloc[-1])
+
+
+def test_large_file_columns_match_preview(monkeypatch):
+    monkeypatch.setattr(app, 'LARGE_FILE_SIZE', 0)
+    file_bytes = b'time,force,force,\n0.0,1.0,2.0,3.0\n0.1,1.5,2.5,3.5\n'
+
+    columns = app.load_csv(file_bytes).columns.tolist()
+    assert columns == ['time', 'force', 'force.1', 'Unnamed: 3']
+
+    for column in columns[1:]:
+        df = app.load_force_columns(file_bytes, 'time', column)
+        assert df.columns.tolist() == ['time', column]
+
+
+def test_find_default_column_matches_first_column():
+    # 第0欄符合優先的關鍵字時，不應被後面符合次要關鍵字的欄位取代
+    lowered_columns = ['時間', 'time (s)', 'force']
+    assert app.find_default_column(lowered_columns, ['时间', '時間', 'time']) == 0
+
+    lowered_columns = ['sumforce', 'left force', 'time']
+    assert app.find_default_column(lowered_columns, ['sumforce', 'force']) == 0
+
+
+def test_find_default_column_defaults_to_zero():
+    assert app.find_default_column(['a', 'b'], ['time']) == 0
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+
+from utils import data_processor
+
+
+def _force_trace(nan_positions=()):
+    """B點後逐漸衰減的震盪曲線，可在指定位置放入NaN"""
+    rng = np.random.default_rng(0)
+    t = np.arange(1500) / 100.0
+    force = 500 + 300 * np.exp(-t) * np.cos(4 * t) + rng.normal(0, 0.2, t.size)
+    force[nan_positions] = np.nan
+    return force.astype(np.float32)
+
+
+def _baseline_balance_idx(force, start, window_size, std_threshold):
+    """原本逐點計算pandas標準差的寫法，作為比較基準"""
+    series = pd.Series(force)
+    for i in range(start + window_size, len(force) - window_size):
+        if series.iloc[i - window_size:i + window_size + 1].std() < std_threshold:
+            return i
+    return -1
+
+
+@pytest.mark.parametrize('nan_positions', [[], [450], [200, 450, 451, 900]])
+def test_balance_idx_matches_baseline_with_nan(nan_positions):
+    pytest.importorskip('numba')
+    force = _force_trace(nan_positions)
+    start = int(np.nanargmax(force))
+    window_size = data_processor.BALANCE_WINDOW_SIZE
+    std_threshold = data_processor.BALANCE_STD_THRESHOLD
+
+    expected = _baseline_balance_idx(force, start, window_size, std_threshold)
+    assert 0 <= expected < len(force) - 1
+
+    kernel_idx = data_processor._scan_balance_idx(
+        force, start, window_size, float(std_threshold)
+    )
+    fallback_idx = data_processor._find_balance_idx(
+        force, start, window_size, std_threshold
+    )
+    assert kernel_idx == fallback_idx == expected
+
+
+def _windowed_balance_idx(force, start, window_size, std_threshold):
+    """與原本的迴圈相同（float64、忽略NaN的樣本標準差），以向量化方式計算所有窗口"""
+    values = force[start:].astype(np.float64)
+    windows = sliding_window_view(values, 2 * window_size + 1)
+    below_threshold = np.nanstd(windows, axis=1, ddof=1) < std_threshold
+    if below_threshold.any():
+        return start + window_size + int(np.argmax(below_threshold))
+    return -1
+
+
+def test_balance_idx_matches_baseline_on_random_float32_traces():
+    pytest.importorskip('numba')
+    window_size = data_processor.BALANCE_WINDOW_SIZE
+    std_threshold = data_processor.BALANCE_STD_THRESHOLD
+
+    mismatches = []
+    for seed in range(2000):
+        # 大幅高於基線的B點之後接標準差接近閾值的雜訊，最容易暴露精度問題
+        rng = np.random.default_rng(seed)
+        force = rng.uniform(200, 1500) + rng.normal(0, rng.uniform(0.95, 1.05), 600)
+        force[rng.integers(0, 20)] += rng.uniform(100, 400)
+        force = force.astype(np.float32)
+        start = int(np.nanargmax(force))
+
+        expected = _windowed_balance_idx(force, start, window_size, std_threshold)
+        kernel_idx = data_processor._scan_balance_idx(
+            force, start, window_size, float(std_threshold)
+        )
+        fallback_idx = data_processor._find_balance_idx(
+            force, start, window_size, std_threshold
+        )
+        if not kernel_idx == fallback_idx == expected:
+            mismatches.append((seed, expected, kernel_idx, fallback_idx))
+
+    assert mismatches == []
+
+
+def test_lttb_keeps_shape_and_key_points():
+    rng = np.random.default_rng(0)
+    x = np.arange(200_000) / 1000.0
+    y = np.cumsum(rng.normal(0, 1, x.size))
+    keep = [int(np.argmin(y)), int(np.argmax(y)), 123_457]
+
+    plot_x, plot_y = data_processor.lttb(x, y, n_out=3000, keep=keep)
+
+    assert 3000 <= len(plot_x) <= 3000 + len(keep)
+    assert len(plot_x) == len(plot_y)
+    assert (plot_x[0], plot_y[0]) == (x[0], y[0])
+    assert (plot_x[-1], plot_y[-1]) == (x[-1], y[-1])
+    assert np.all(np.diff(plot_x) > 0)
+    for idx in keep:
+        assert x[idx] in plot_x
+        assert plot_y[np.searchsorted(plot_x, x[idx])] == y[idx]
+
+
+def test_lttb_returns_short_input_unchanged():
+    x = np.arange(100.0)
+    plot_x, plot_y = data_processor.lttb(x, x * 2, n_out=3000, keep=[5])
+    assert np.array_equal(plot_x, x) and np.array_equal(plot_y, x * 2)
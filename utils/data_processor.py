@@ -1,10 +1,18 @@
+import io
 import pandas as pd
 import numpy as np
 from fpdf import FPDF
-import plotly.io as pio
 import os
 import streamlit as st
-import plotly.graph_objects as go
+
+try:
+    from numba import njit, types as nb_types
+except ImportError:  # numba 為選用套件，未安裝時改用向量化的 rolling std
+    njit = None
+
+# 平衡點（C點）判定：前後窗口大小與標準差閾值（牛頓）
+BALANCE_WINDOW_SIZE = 30
+BALANCE_STD_THRESHOLD = 1
 
 class PDF(FPDF):
     def __init__(self):
@@ -20,42 +28,140 @@ class PDF(FPDF):
         # 換行
         self.ln(10)
 
-def find_balance_point(df, max_force_idx, window_size=30, std_threshold=1):
-    """找出平衡點（C點）
+def _centered_rolling_std(values, window_size):
+    """計算每個點前後window_size個點（共2*window_size+1點）的樣本標準差
+    
+    與pandas的.std()相同，窗口內的NaN不計入，有效點少於2個時為NaN；
+    窗口不完整的頭尾位置為NaN。
+    """
+    window = 2 * window_size + 1
+    if len(values) < window:
+        return np.full(len(values), np.nan)
     
-    參數:
-    df: DataFrame，包含力量數據
-    max_force_idx: int，B點（最大力量）的索引
-    window_size: int，計算標準差時使用的窗口大小
-    std_threshold: float，標準差閾值（牛頓）
+    stds = pd.Series(values).rolling(window, center=True, min_periods=2).std().to_numpy(copy=True)
+    stds[:window_size] = np.nan
+    stds[len(stds) - window_size:] = np.nan
+    return stds
+
+def _scan_balance_idx(force, start, window_size, std_threshold):
+    """從start開始滑動窗口，返回第一個窗口標準差小於閾值的中心索引，找不到則返回-1
     
-    返回:
-    dict，包含時間和力量值
+    以累加和與平方和增量更新窗口變異數，找到即提前結束，不需要計算完整的標準差陣列。
+    與pandas的.std()相同，窗口內的NaN不計入，有效點少於2個的窗口不判定。
     """
-    # 只考慮B點之後的數據
-    df_after_max = df.iloc[max_force_idx:]
-    
-    # 對每個點計算其前後window_size個點的標準差
-    for i in range(window_size, len(df_after_max) - window_size):
-        current_idx = df_after_max.index[i]
-        # 取得前後window_size個點的數據
-        window_data = df.loc[current_idx - window_size : current_idx + window_size, 'force']
-        # 計算標準差
-        std = window_data.std()
+    window = 2 * window_size + 1
+    n = len(force)
+    if n - start < window:
+        return -1
+    
+    # 以起點數值作為基準，避免大數相減造成的精度損失；
+    # 輸入為float32，逐點轉為float64再運算，平方與累加都以float64進行
+    ref = np.float64(force[start])
+    s = 0.0
+    s2 = 0.0
+    # 窗口內的有效（非NaN）點數，NaN離開窗口後即恢復計算
+    count = 0
+    for i in range(start, start + window):
+        d = np.float64(force[i]) - ref
+        if d == d:
+            count += 1
+            s += d
+            s2 += d * d
+    
+    threshold_var = std_threshold * std_threshold
+    for i in range(start + window_size, n - window_size):
+        if count >= 2:
+            var = (s2 - s * s / count) / (count - 1)
+            if var < threshold_var:
+                return i
         
-        # 如果標準差小於閾值，這個點就是C點
-        if std < std_threshold:
-            return {
-                'time': df.loc[current_idx, 'time'],
-                'force': df.loc[current_idx, 'force']
-            }
-    
-    # 如果找不到符合條件的點，返回最後一個點
-    last_idx = df.index[-1]
-    return {
-        'time': df.loc[last_idx, 'time'],
-        'force': df.loc[last_idx, 'force']
-    }
+        # 窗口向右滑動一格
+        if i + window_size + 1 < n:
+            d_out = np.float64(force[i - window_size]) - ref
+            if d_out == d_out:
+                count -= 1
+                s -= d_out
+                s2 -= d_out * d_out
+            
+            d_in = np.float64(force[i + window_size + 1]) - ref
+            if d_in == d_in:
+                count += 1
+                s += d_in
+                s2 += d_in * d_in
+    
+    return -1
+
+def _scan_force_points(force, window_size, std_threshold):
+    """找出最小值、最大值的索引，再從最大值開始尋找平衡點
+    
+    最小值與最大值在同一個迴圈中求得（忽略NaN），平衡點沿用_scan_balance_idx
+    （窗口內的NaN不計入），因此B點之後的數據會再讀取一次。找不到平衡點時返回-1。
+    """
+    min_idx = -1
+    max_idx = -1
+    for i in range(len(force)):
+        value = force[i]
+        if value != value:  # NaN
+            continue
+        if min_idx < 0 or value < force[min_idx]:
+            min_idx = i
+        if max_idx < 0 or value > force[max_idx]:
+            max_idx = i
+    
+    if max_idx < 0:
+        return min_idx, max_idx, -1
+    
+    return min_idx, max_idx, _scan_balance_idx(force, max_idx, window_size, std_threshold)
+
+if njit is not None:
+    # 指定型別簽名，在載入模組時即完成編譯（並快取至磁碟），避免第一次分析時的JIT延遲
+    # pandas返回的陣列可能是唯讀的，因此同時編譯可寫與唯讀兩種版本
+    _force_array_types = [
+        nb_types.Array(nb_types.float32, 1, 'C'),
+        nb_types.Array(nb_types.float32, 1, 'C', readonly=True),
+    ]
+    _scan_balance_idx = njit(
+        [nb_types.int64(arr, nb_types.int64, nb_types.int64, nb_types.float64)
+         for arr in _force_array_types],
+        cache=True
+    )(_scan_balance_idx)
+    _scan_force_points = njit(
+        [nb_types.UniTuple(nb_types.int64, 3)(arr, nb_types.int64, nb_types.float64)
+         for arr in _force_array_types],
+        cache=True
+    )(_scan_force_points)
+
+def _find_balance_idx(force, start, window_size, std_threshold):
+    """返回B點之後第一個窗口標準差小於閾值的索引，找不到則返回-1
+    
+    未安裝numba時使用，結果與_scan_balance_idx相同。
+    """
+    stds = _centered_rolling_std(force[start:], window_size)
+    below_threshold = stds < std_threshold
+    if below_threshold.any():
+        return start + int(np.argmax(below_threshold))
+    return -1
+
+def _find_force_points(force, window_size, std_threshold):
+    """返回A點（最小力量）、B點（最大力量）與C點（平衡點）的索引
+    
+    force須為連續的float32陣列；找不到平衡點時以最後一個點作為C點。
+    """
+    if njit is not None:
+        min_idx, max_idx, balance_idx = _scan_force_points(
+            force, window_size, float(std_threshold)
+        )
+        if max_idx < 0:
+            raise ValueError("力量數據全為NaN")
+    else:
+        min_idx = int(np.nanargmin(force))
+        max_idx = int(np.nanargmax(force))
+        balance_idx = _find_balance_idx(force, max_idx, window_size, std_threshold)
+    
+    if balance_idx < 0:
+        balance_idx = len(force) - 1
+    
+    return min_idx, max_idx, balance_idx
 
 def process_force_data(df):
     """處理力量數據並找出關鍵點"""
@@ -73,20 +179,31 @@ def process_force_data(df):
                 st.warning("處理數據找不到預設的力量欄位: {'force'}，請自行選擇力量欄位")
         return df, None
     
+    # 直接在連續的NumPy陣列上運算，避免pandas標籤索引的開銷
+    time = df['time'].to_numpy()
+    force = np.ascontiguousarray(df['force'].to_numpy(), dtype=np.float32)
+    
     # 找出A、B、C點
-    min_force_idx = df['force'].idxmin()
+    min_force_idx, max_force_idx, balance_idx = _find_force_points(
+        force, BALANCE_WINDOW_SIZE, BALANCE_STD_THRESHOLD
+    )
     point_a = {
-        'time': df.loc[min_force_idx, 'time'],
-        'force': df.loc[min_force_idx, 'force']
+        'index': min_force_idx,
+        'time': time[min_force_idx],
+        'force': force[min_force_idx]
     }
     
-    max_force_idx = df['force'].idxmax()
     point_b = {
-        'time': df.loc[max_force_idx, 'time'],
-        'force': df.loc[max_force_idx, 'force']
+        'index': max_force_idx,
+        'time': time[max_force_idx],
+        'force': force[max_force_idx]
     }
     
-    point_c = find_balance_point(df, max_force_idx)
+    point_c = {
+        'index': balance_idx,
+        'time': time[balance_idx],
+        'force': force[balance_idx]
+    }
     
     # 計算額外的統計指標
     delta_force = point_b['force'] - point_a['force']  # 力量變化
@@ -107,8 +224,147 @@ def process_force_data(df):
     
     return df, points
 
+def lttb(x, y, n_out=3000, keep=()):
+    """以Largest-Triangle-Three-Buckets演算法將曲線降採樣至n_out個點
+    
+    每個區間保留與前一選取點、下一區間平均點所構成三角形面積最大的點，
+    因此峰值等視覺特徵會被保留。點數不超過n_out時直接返回原數據。
+    keep中的索引（例如A、B、C點）一定會保留，因此返回的點數最多為n_out+len(keep)。
+    
+    返回:
+    tuple，降採樣後的(x, y)陣列
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return x, y
+    
+    # 首尾兩點固定保留，中間的點平均分成n_out-2個區間
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    
+    prev = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        # 下一區間的平均點（最後一個區間以終點代替）
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        
+        area = np.abs(
+            (x[prev] - avg_x) * (y[start:end] - y[prev])
+            - (x[prev] - x[start:end]) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    
+    # 加入必須保留的點，排序後x仍維持原本的順序
+    selected = np.union1d(selected, np.asarray(keep, dtype=np.int64))
+    return x[selected], y[selected]
+
+# 不同關鍵點的顏色
+POINT_COLORS = {
+    'A': 'rgb(255,0,0)',    # 紅色
+    'B': 'rgb(0,255,0)',    # 綠色
+    'C': 'rgb(255,165,0)'   # 橙色
+}
+
+def build_figure(df, points):
+    """創建力量-時間圖，介面與PDF報告共用
+    
+    主要曲線經LTTB降採樣後以WebGL繪製，A、B、C關鍵點使用原始座標。
+    """
+    # 延遲載入plotly，只有繪圖時才需要
+    import plotly.graph_objects as go
+    
+    fig = go.Figure()
+    
+    # 添加主要曲線（降採樣後以WebGL繪製，關鍵點仍使用原始座標）
+    plot_time, plot_force = lttb(
+        df['time'].to_numpy(),
+        df['force'].to_numpy(),
+        keep=[points[name]['index'] for name in ['A', 'B', 'C']]
+    )
+    fig.add_trace(go.Scattergl(
+        x=plot_time,
+        y=plot_force,
+        mode='lines',
+        name='力量曲線'
+    ))
+    
+    # 設置不同點的文字位置和對齊方式
+    text_positions = {
+        'A': 'top center',      # A點文字在上方靠左
+        'B': 'middle right',  # B點文字在右側中間
+        'C': 'bottom right'   # C點文字在右下方
+    }
+    
+    # 以單一軌跡添加A、B、C關鍵點，減少圖表的軌跡數量
+    point_names = ['A', 'B', 'C']
+    fig.add_trace(go.Scatter(
+        x=[points[name]['time'] for name in point_names],
+        y=[points[name]['force'] for name in point_names],
+        mode='markers+text',
+        name='關鍵點',
+        text=[
+            f'{name}點<br>時間: {points[name]["time"]:.2f}s<br>力量: {points[name]["force"]:.2f}N'
+            for name in point_names
+        ],
+        textposition=[text_positions[name] for name in point_names],
+        marker=dict(color=[POINT_COLORS[name] for name in point_names], size=10),
+        textfont=dict(size=12),  # 調整文字大小
+    ))
+    
+    # 設置圖表樣式
+    fig.update_layout(
+        title='力量-時間關係圖',
+        xaxis_title='時間 (秒)',
+        yaxis_title='力量 (N)',
+        hovermode='x unified',
+        # 增加圖表邊距以確保文字不會被切掉
+        margin=dict(l=50, r=100, t=50, b=50)  # 增加右側邊距
+    )
+    
+    return fig
+
+def _to_svg_figure(fig):
+    """複製圖表，並將WebGL曲線改為SVG曲線，確保kaleido靜態輸出的結果一致"""
+    # 延遲載入plotly，只有生成報告時才需要
+    import plotly.graph_objects as go
+    
+    traces = []
+    for trace in fig.data:
+        if trace.type == 'scattergl':
+            trace = go.Scatter(
+                x=trace.x,
+                y=trace.y,
+                mode=trace.mode,
+                name=trace.name,
+                line=trace.line.to_plotly_json()
+            )
+        traces.append(trace)
+    return go.Figure(data=traces, layout=fig.layout)
+
+def render_plot_image(fig):
+    """將圖表輸出為JPEG圖片
+    
+    FPDF可直接以DCTDecode嵌入JPEG，不需要像PNG一樣解壓縮後重新壓縮像素。
+    """
+    # 延遲載入plotly.io，只有生成報告時才需要
+    import plotly.io as pio
+    
+    return pio.to_image(
+        fig,
+        format="jpeg",
+        engine="kaleido",
+        scale=2  # 提高解析度
+    )
+
 def generate_pdf_report(df, points, fig):
-    """生成PDF報告"""
+    """生成PDF報告，返回PDF文件內容（bytes）"""
     pdf = FPDF()
     pdf.add_page()
     
@@ -146,72 +402,20 @@ def generate_pdf_report(df, points, fig):
     pdf.set_font('Arial', '', 12)
     pdf.cell(0, 5, f"{points['stats']['recovery_time']:.2f} (sec)", 0, 1)
     
-    # 創建新的圖表實例
-    new_fig = go.Figure()
-    
-    # 添加主要曲線
-    new_fig.add_trace(go.Scatter(
-        x=df['time'],
-        y=df['force'],
-        mode='lines',
-        name='力量曲線',
-        line=dict(color='rgb(0,100,255)', width=2)
-    ))
-    
-    # 設置不同點的文字位置和對齊方式
-    text_positions = {
-        'A': 'top center',      # A點文字在上方靠左
-        'B': 'middle right',    # B點文字在右側中間
-        'C': 'bottom right'     # C點文字在右下方
-    }
-    
-    # 設置不同關鍵點的顏色
-    colors = {
-        'A': 'rgb(255,0,0)',    # 紅色
-        'B': 'rgb(0,255,0)',    # 綠色
-        'C': 'rgb(255,165,0)'   # 橙色
-    }
-    
-    # 添加關鍵點
-    for point_name, point_data in points.items():
-        # 只處理 A、B、C 點
-        if point_name in ['A', 'B', 'C']:
-            text_content = f'{point_name}點<br>時間: {point_data["time"]:.2f}s<br>力量: {point_data["force"]:.2f}N'
-            new_fig.add_trace(go.Scatter(
-                x=[point_data['time']],
-                y=[point_data['force']],
-                mode='markers+text',
-                name=f'點位 {point_name}',
-                text=[text_content],
-                textposition=text_positions[point_name],
-                marker=dict(color=colors[point_name], size=12),
-                textfont=dict(size=12)
-            ))
-    
-    # 設置圖表樣式
-    new_fig.update_layout(
-        title='力量-時間關係圖',
-        xaxis_title='時間 (秒)',
-        yaxis_title='力量 (N)',
-        hovermode='x unified',
-        margin=dict(l=50, r=100, t=50, b=50),  # 增加右側邊距
-        width=1000,
-        height=600
+    # 沿用介面上的圖表，只調整PDF用的線條與尺寸
+    pdf_fig = _to_svg_figure(fig)
+    pdf_fig.update_traces(
+        line=dict(color='rgb(0,100,255)', width=2),
+        selector=dict(name='力量曲線')
     )
+    pdf_fig.update_traces(marker=dict(size=12), selector=dict(name='關鍵點'))
+    pdf_fig.update_layout(width=1000, height=600)
     
-    # 使用高品質設置保存圖表
-    pio.write_image(
-        new_fig, 
-        "temp_plot.png",
-        format="png",
-        engine="kaleido",
-        scale=2  # 提高解析度
-    )
+    # 使用高品質設置輸出圖表
+    plot_image = io.BytesIO(render_plot_image(pdf_fig))
     
     # 在PDF中添加圖表
-    pdf.image("temp_plot.png", x=10, y=100, w=190)
-    
-    # 保存PDF
-    pdf.output("force_analysis_report.pdf")
+    pdf.image(plot_image, x=10, y=100, w=190)
     
-    return "force_analysis_report.pdf" 
\ No newline at end of file
+    # 直接在記憶體中返回PDF內容，不寫入磁碟
+    return bytes(pdf.output()) 
\ No newline at end of file